@@ -5,246 +5,490 @@ Processes PDF efficiently with better memory handling than Node.js
 Usage: python3 scripts/embedPDFWithMetadata.py
 """
 
+import asyncio
+import base64
+import hashlib
+import multiprocessing
 import os
+import random
 import re
+import sqlite3
 import time
-from typing import List, Dict, Tuple
+from bisect import bisect_left, bisect_right
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import islice
+from typing import List, Dict, Tuple, Iterable, Iterator, AsyncIterator
+import numpy as np
+import tiktoken
+from tqdm import tqdm
 from dotenv import load_dotenv
-import PyPDF2
-from openai import OpenAI
-from pinecone import Pinecone, ServerlessSpec
-
-# Load environment variables
-load_dotenv()
+import pypdfium2 as pdfium
+from openai import AsyncOpenAI
+from pinecone import ServerlessSpec
+from pinecone.grpc import PineconeGRPC
 
 # Configuration
 CONFIG = {
     'pdf_path': 'NextGen-User Manual.pdf',
-    'chunk_size': 800,
-    'chunk_overlap': 150,
+    'chunk_size': 400,  # Tokens per chunk
+    'chunk_overlap': 75,  # Tokens shared between neighbouring chunks
+    'tokenizer': 'cl100k_base',  # Encoding used by text-embedding-3 models
+    'extract_workers': os.cpu_count() or 1,  # Processes extracting PDF pages in parallel
+    'extract_parallel_min_pages': 1000,  # Smaller PDFs are extracted serially
+    'extract_pages_per_task': 8,  # Pages per worker task, amortizes IPC
     'embedding_model': 'text-embedding-3-small',
     'embedding_dimensions': 512,
     'embedding_batch_size': 100,
+    'embedding_batch_tokens': 250000,  # Stay under OpenAI's per-request token cap
+    'embedding_sort_window': 800,  # Chunks buffered and sorted by length before batching
+    'embedding_cache_path': '.embed_cache.db',  # Delete to force re-embedding
+    'embedding_concurrency': 8,  # Max in-flight OpenAI requests
+    'upload_concurrency': 8,  # Concurrent Pinecone upserts
+    'upload_queue_size': 4,  # Embedded batches waiting for upload
 }
 
-# Initialize clients
-openai_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-pinecone_client = Pinecone(api_key=os.getenv('PINECONE_API_KEY'))
+# Clients are created in init_clients() rather than at import, so extraction
+# worker processes that re-import this script don't set them up
+openai_client = None
+pinecone_client = None
+
+
+@dataclass(slots=True)
+class Chunk:
+    """A chunk of manual text with its retrieval metadata"""
+    text: str
+    page: int
+    topic: str
+    task: str
+    role_min: int
+    tokens: int
+    id: str = ''  # Assigned in stream order by assign_chunk_ids
 
-chunk_counter = 0
 
+# Topic rules in priority order: (topic, pattern, task, role_min).
+# When a chunk matches several topics, the earliest rule wins. Patterns are
+# lowercase and matched against a lowercased copy: re.IGNORECASE disables
+# the literal-prefix scan and is slower than one lower() per chunk.
+TOPIC_RULES = [
+    ('attendance', re.compile(r'check.?in|attendance|qr.?(code|scan)'), 'procedure', 1),
+    ('children', re.compile(r'register.*child|add.*child|child.*record|formal.?id'), None, 3),
+    ('guardians', re.compile(r'guardian|parent|emergency'), 'navigation', 3),
+    ('reports', re.compile(r'report|analytic|dashboard|statistic'), 'navigation', 5),
+    ('staff_management', re.compile(r'staff.*management|volunteer.*assign|access.*level'), 'navigation', 5),
+    ('email', re.compile(r'email.*template|send.*email|smtp'), 'procedure', 5),
+    ('settings', re.compile(r'settings|configuration|api.*key|deployment'), 'navigation', 10),
+    ('navigation', re.compile(r'navigation|menu|button|sidebar'), 'navigation', 1),
+    ('troubleshooting', re.compile(r'error|troubleshoot|fix|debug'), 'troubleshooting', 1),
+    ('overview', re.compile(r'introduction|overview|getting.*started'), 'reference', 1),
+]
+REGISTER_RE = re.compile(r'register|add')
+BOUNDARY_RE = re.compile(r'[.\n]')
 
-def detect_metadata(text: str, page_num: int) -> Dict:
-    """Detect metadata from chunk content using pattern matching"""
+
+def detect_metadata(text: str) -> Tuple[str, str, int]:
+    """Detect (topic, task, role_min) from chunk content using pattern matching"""
     text_lower = text.lower()
     
-    topic = 'general'
-    task = 'reference'
-    role_min = 1
+    topic, task, role_min = 'general', 'reference', 1
+    
+    for rule_topic, pattern, rule_task, rule_role_min in TOPIC_RULES:
+        if pattern.search(text_lower):
+            topic, task, role_min = rule_topic, rule_task, rule_role_min
+            break
     
-    # Attendance/Check-in
-    if re.search(r'check.?in|attendance|qr.?(code|scan)', text_lower):
-        topic = 'attendance'
-        task = 'procedure'
-        role_min = 1
-    # Children Management
-    elif re.search(r'register.*child|add.*child|child.*record|formal.?id', text_lower):
-        topic = 'children'
-        task = 'procedure' if re.search(r'register|add', text_lower) else 'navigation'
-        role_min = 3
-    # Guardians
-    elif re.search(r'guardian|parent|emergency', text_lower):
-        topic = 'guardians'
-        task = 'navigation'
-        role_min = 3
-    # Reports
-    elif re.search(r'report|analytic|dashboard|statistic', text_lower):
-        topic = 'reports'
-        task = 'navigation'
-        role_min = 5
-    # Staff Management
-    elif re.search(r'staff.*management|volunteer.*assign|access.*level', text_lower):
-        topic = 'staff_management'
-        task = 'navigation'
-        role_min = 5
-    # Email
-    elif re.search(r'email.*template|send.*email|smtp', text_lower):
-        topic = 'email'
-        task = 'procedure'
-        role_min = 5
-    # Settings
-    elif re.search(r'settings|configuration|api.*key|deployment', text_lower):
-        topic = 'settings'
-        task = 'navigation'
-        role_min = 10
-    # Navigation
-    elif re.search(r'navigation|menu|button|sidebar', text_lower):
-        topic = 'navigation'
-        task = 'navigation'
-        role_min = 1
-    # Troubleshooting
-    elif re.search(r'error|troubleshoot|fix|debug', text_lower):
-        topic = 'troubleshooting'
-        task = 'troubleshooting'
-        role_min = 1
-    # Overview
-    elif re.search(r'introduction|overview|getting.*started', text_lower):
-        topic = 'overview'
-        task = 'reference'
-        role_min = 1
+    # Children Management: registering/adding is a procedure, anything else navigation
+    if topic == 'children':
+        task = 'procedure' if REGISTER_RE.search(text_lower) else 'navigation'
     
-    return {
-        'topic': topic,
-        'task': task,
-        'role_min': role_min,
-        'page': page_num
-    }
+    return topic, task, role_min
 
 
-def extract_text_from_pdf(pdf_path: str) -> List[Dict]:
-    """Extract text from PDF page by page"""
-    print(f'📄 Reading PDF: {pdf_path}')
-    
-    pages = []
-    with open(pdf_path, 'rb') as file:
-        pdf_reader = PyPDF2.PdfReader(file)
-        total_pages = len(pdf_reader.pages)
-        
-        print(f'✅ PDF has {total_pages} pages')
-        
+# Per-process PDF handle for extraction workers (PDFium is not thread-safe)
+_worker_pdf = None
+
+
+def _init_extract_worker(pdf_path: str):
+    """Open the PDF once in each extraction worker process"""
+    global _worker_pdf
+    _worker_pdf = pdfium.PdfDocument(pdf_path)
+
+
+def _page_text(pdf: pdfium.PdfDocument, page_num: int) -> str:
+    """Extract the text of a single page"""
+    page = pdf[page_num]
+    textpage = page.get_textpage()
+    # PDFium reports line breaks as \r\n
+    text = textpage.get_text_range().replace('\r\n', '\n')
+    textpage.close()
+    page.close()
+    return text
+
+
+def _extract_pages(first: int, stop: int) -> List[str]:
+    """Extract a run of pages in a worker process"""
+    return [_page_text(_worker_pdf, page_num) for page_num in range(first, stop)]
+
+
+def _extract_serial(pdf_path: str, total_pages: int) -> Iterator[str]:
+    """Extract page texts in order in this process"""
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
         for page_num in range(total_pages):
-            page = pdf_reader.pages[page_num]
-            text = page.extract_text()
-            
-            if text and text.strip():
-                pages.append({
-                    'page_num': page_num + 1,
-                    'text': text
-                })
-            
-            # Progress indicator every 20 pages
-            if (page_num + 1) % 20 == 0:
-                print(f'  Extracted {page_num + 1}/{total_pages} pages...')
+            yield _page_text(pdf, page_num)
+    finally:
+        pdf.close()
+
+
+def _extract_parallel(pdf_path: str, total_pages: int) -> Iterator[str]:
+    """Extract page texts in order across worker processes, a bounded window at a time"""
+    workers = CONFIG['extract_workers']
+    step = CONFIG['extract_pages_per_task']
+    # forkserver imports this script once and forks workers from it; spawn re-imports
+    # per worker. Both avoid forking this process, whose generator runs in a thread.
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
     
-    print(f'✅ Extracted {len(pages)} pages with text\n')
-    return pages
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context(method),
+        initializer=_init_extract_worker,
+        initargs=(pdf_path,)
+    ) as executor:
+        # Only keep a couple of tasks per worker queued, so extraction can't run far
+        # ahead of the network-bound consumer and buffer the whole manual
+        ranges = iter(range(0, total_pages, step))
+        in_flight = deque()
+        for first in islice(ranges, workers * 2):
+            in_flight.append(executor.submit(_extract_pages, first, min(first + step, total_pages)))
+        
+        while in_flight:
+            texts = in_flight.popleft().result()
+            first = next(ranges, None)
+            if first is not None:
+                in_flight.append(executor.submit(_extract_pages, first, min(first + step, total_pages)))
+            yield from texts
 
 
-def create_chunks(pages: List[Dict]) -> List[Dict]:
-    """Create overlapping chunks with metadata"""
-    global chunk_counter
-    chunks = []
+def extract_text_from_pdf(pdf_path: str) -> Iterator[Dict]:
+    """Extract text from PDF pages, yielding pages in order"""
+    tqdm.write(f'📄 Reading PDF: {pdf_path}')
+    
+    pdf = pdfium.PdfDocument(pdf_path)
+    total_pages = len(pdf)
+    pdf.close()
+    
+    tqdm.write(f'✅ PDF has {total_pages} pages')
+    
+    # Starting worker processes costs more than extracting a typical manual serially
+    if CONFIG['extract_workers'] > 1 and total_pages >= CONFIG['extract_parallel_min_pages']:
+        texts = _extract_parallel(pdf_path, total_pages)
+    else:
+        texts = _extract_serial(pdf_path, total_pages)
+    
+    extracted = 0
+    for page_num, text in enumerate(tqdm(texts, total=total_pages, desc='extract', unit='page')):
+        if text and text.strip():
+            extracted += 1
+            yield {
+                'page_num': page_num + 1,
+                'text': text
+            }
     
-    print(f'Processing {len(pages)} pages into chunks...')
+    tqdm.write(f'✅ Extracted {extracted} pages with text')
+
+
+def create_chunks(pages: Iterable[Dict]) -> Iterator[Chunk]:
+    """Create overlapping token-sized chunks with metadata, yielding each chunk as it is built"""
+    encoding = tiktoken.get_encoding(CONFIG['tokenizer'])
+    chunk_size = CONFIG['chunk_size']
+    chunk_overlap = CONFIG['chunk_overlap']
+    min_break = chunk_size * 0.7  # Don't break at a sentence that leaves the chunk too short
     
-    for idx, page in enumerate(pages):
-        text = page['text']
+    for page in pages:
+        tokens = encoding.encode_ordinary(page['text'])
+        # Character offset where each token starts, plus an end sentinel
+        text, offsets = encoding.decode_with_offsets(tokens)
+        offsets.append(len(text))
+        # Sentence/newline offsets, found once per page
+        boundaries = [m.start() for m in BOUNDARY_RE.finditer(text)]
         start = 0
         
-        # Progress indicator
-        if (idx + 1) % 10 == 0:
-            print(f'  Chunking page {idx + 1}/{len(pages)}...')
-        
-        while start < len(text):
-            end = min(start + CONFIG['chunk_size'], len(text))
-            chunk_text = text[start:end]
+        while start < len(tokens):
+            end = min(start + chunk_size, len(tokens))
             
-            # Try to break at sentence or newline
-            if end < len(text):
-                last_period = chunk_text.rfind('.')
-                last_newline = chunk_text.rfind('\n')
-                break_point = max(last_period, last_newline)
-                
-                if break_point > CONFIG['chunk_size'] * 0.7:
-                    chunk_text = text[start:start + break_point + 1]
+            # Try to break after the token holding the last sentence or newline in the window
+            if end < len(tokens):
+                last = bisect_left(boundaries, offsets[end]) - 1
+                if last >= 0:
+                    break_end = bisect_right(offsets, boundaries[last])
+                    if break_end - start > min_break:
+                        end = break_end
             
-            # Clean and validate
-            chunk_text = chunk_text.strip()
+            # Clean and validate: trim whitespace by index so only one string is allocated
+            first, last = offsets[start], offsets[end]
+            while first < last and text[first].isspace():
+                first += 1
+            while last > first and text[last - 1].isspace():
+                last -= 1
+            chunk_text = text[first:last]
             
             if len(chunk_text) > 100:  # Only meaningful chunks
-                metadata = detect_metadata(chunk_text, page['page_num'])
+                topic, task, role_min = detect_metadata(chunk_text)
                 
-                chunks.append({
-                    'id': f'chunk-{chunk_counter}',
-                    'text': chunk_text,
-                    **metadata
-                })
-                chunk_counter += 1
+                yield Chunk(
+                    text=chunk_text,
+                    page=page['page_num'],
+                    topic=topic,
+                    task=task,
+                    role_min=role_min,
+                    tokens=end - start
+                )
             
-            start += (len(chunk_text) - CONFIG['chunk_overlap'])
+            if end >= len(tokens):
+                break
+            # Advance by the unstripped window so every step moves forward
+            start = max(end - chunk_overlap, start + 1)
+
+
+def assign_chunk_ids(chunks: Iterable[Chunk]) -> Iterator[Chunk]:
+    """Number chunks in stream order, independent of how they were produced"""
+    for i, chunk in enumerate(chunks):
+        chunk.id = f'chunk-{i}'
+        yield chunk
+
+
+def batch_chunks(chunks: Iterable[Chunk]) -> Iterator[List[Chunk]]:
+    """Group chunks into embedding batches of similar token count"""
+    batch_size = CONFIG['embedding_batch_size']
+    max_tokens = CONFIG['embedding_batch_tokens']
+    chunks = iter(chunks)
     
-    return chunks
+    while True:
+        # Sort a bounded window (not the whole stream) so batches stay evenly sized.
+        # Ties sort by text so repeated chunks land side by side in the same batch.
+        window = sorted(
+            islice(chunks, CONFIG['embedding_sort_window']),
+            key=lambda c: (c.tokens, c.text),
+            reverse=True
+        )
+        if not window:
+            return
+        
+        batch = []
+        batch_tokens = 0
+        for chunk in window:
+            if batch and (len(batch) >= batch_size or batch_tokens + chunk.tokens > max_tokens):
+                yield batch
+                batch = []
+                batch_tokens = 0
+            batch.append(chunk)
+            batch_tokens += chunk.tokens
+        yield batch
+
+
+def open_embedding_cache(path: str) -> sqlite3.Connection:
+    """Open the on-disk embedding cache, creating it if needed"""
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('CREATE TABLE IF NOT EXISTS emb (k BLOB PRIMARY KEY, v BLOB)')
+    return conn
+
 
+def embedding_cache_key(text: str) -> bytes:
+    """Cache key covering the model settings and the exact chunk text"""
+    return hashlib.sha256(
+        f"{CONFIG['embedding_model']}:{CONFIG['embedding_dimensions']}:{text}".encode()
+    ).digest()
 
-def generate_embeddings(chunks: List[Dict]) -> List[Dict]:
-    """Generate embeddings using OpenAI"""
-    print(f'🧠 Generating embeddings for {len(chunks)} chunks...')
+
+def get_cached_embeddings(cache: sqlite3.Connection, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+    """Look up cached embeddings for the given keys"""
+    rows = cache.execute(
+        f'SELECT k, v FROM emb WHERE k IN ({",".join("?" * len(keys))})', keys
+    ).fetchall()
+    return {k: np.frombuffer(v, dtype=np.float32) for k, v in rows}
+
+
+def put_cached_embeddings(cache: sqlite3.Connection, items: Dict[bytes, np.ndarray]):
+    """Store new embeddings as packed float32 blobs"""
+    cache.executemany(
+        'INSERT OR IGNORE INTO emb (k, v) VALUES (?, ?)',
+        [(k, v.tobytes()) for k, v in items.items()]
+    )
+    cache.commit()
+
+
+def to_pinecone_vectors(batch: List[Chunk], embs: np.ndarray) -> List[Dict]:
+    """Convert a batch of chunks and their embedding rows to Pinecone upsert format"""
+    return [
+        {
+            'id': chunk.id,
+            'values': embs[k].tolist(),
+            'metadata': {
+                'text': chunk.text,
+                'page': chunk.page,
+                'topic': chunk.topic,
+                'task': chunk.task,
+                'role_min': chunk.role_min,
+                'source': 'NextGen-User Manual.pdf',
+                'type': 'documentation'
+            }
+        }
+        for k, chunk in enumerate(batch)
+    ]
+
+
+async def _finished_results(done: Iterable[asyncio.Task]) -> List:
+    """Results of finished tasks; raises the first failure once every outcome is retrieved"""
+    results = await asyncio.gather(*done, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+async def generate_embeddings(chunks: Iterator[Chunk]) -> AsyncIterator[List[Dict]]:
+    """Generate embeddings using OpenAI, yielding upsert-ready vector batches as they finish"""
+    tqdm.write('🧠 Generating embeddings...')
     
-    embeddings = []
-    batch_size = CONFIG['embedding_batch_size']
+    batches = batch_chunks(chunks)
+    cache = open_embedding_cache(CONFIG['embedding_cache_path'])
+    progress = tqdm(desc='embed', unit='chunk')
+    cache_hits = 0
+    duplicates = 0
     
-    for i in range(0, len(chunks), batch_size):
-        batch = chunks[i:i + batch_size]
-        texts = [c['text'] for c in batch]
+    async def _one(batch: List[Chunk]) -> List[Dict]:
+        nonlocal cache_hits, duplicates
+        keys = [embedding_cache_key(c.text) for c in batch]
+        embs = np.empty((len(batch), CONFIG['embedding_dimensions']), dtype=np.float32)
+        cached = get_cached_embeddings(cache, keys)
         
-        batch_num = i // batch_size + 1
-        total_batches = (len(chunks) + batch_size - 1) // batch_size
-        print(f'  Batch {batch_num}/{total_batches}...')
+        # Cache misses grouped by key, so repeated texts are embedded once
+        misses: Dict[bytes, List[int]] = {}
+        for j, k in enumerate(keys):
+            if k in cached:
+                embs[j] = cached[k]
+            else:
+                misses.setdefault(k, []).append(j)
+        missed_rows = sum(len(rows) for rows in misses.values())
+        cache_hits += len(batch) - missed_rows
+        duplicates += missed_rows - len(misses)
         
-        # Call OpenAI API
-        response = openai_client.embeddings.create(
-            model=CONFIG['embedding_model'],
-            input=texts,
-            dimensions=CONFIG['embedding_dimensions']
-        )
+        # Only send unique cache misses to OpenAI
+        if misses:
+            # Small jitter so requests don't all hit the API at the same instant
+            await asyncio.sleep(random.uniform(0, 0.1))
+            response = await openai_client.embeddings.create(
+                model=CONFIG['embedding_model'],
+                input=[batch[rows[0]].text for rows in misses.values()],
+                dimensions=CONFIG['embedding_dimensions'],
+                # Raw float32 buffers: smaller payload and no per-float parsing
+                encoding_format='base64'
+            )
+            for rows, embedding_data in zip(misses.values(), response.data):
+                embs[rows] = np.frombuffer(base64.b64decode(embedding_data.embedding), dtype=np.float32)
+            put_cached_embeddings(cache, {k: embs[rows[0]] for k, rows in misses.items()})
+        
+        progress.update(len(batch))
         
-        # Combine chunks with embeddings
-        for j, embedding_data in enumerate(response.data):
-            embeddings.append({
-                **batch[j],
-                'embedding': embedding_data.embedding
-            })
+        return to_pinecone_vectors(batch, embs)
+    
+    # Batches are pulled from the chunk stream only when a request slot frees up, and
+    # finished batches are yielded as soon as they complete, so memory stays bounded
+    # by the sort window plus in-flight batches, whatever the manual size. Extraction and
+    # chunking run in a worker thread to keep the event loop free for in-flight requests.
+    # 429s are retried with backoff by the client (max_retries).
+    pending = set()
+    try:
+        while True:
+            if len(pending) >= CONFIG['embedding_concurrency']:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for vectors in await _finished_results(done):
+                    yield vectors
+            
+            batch = await asyncio.to_thread(next, batches, None)
+            if batch is None:
+                break
+            pending.add(asyncio.create_task(_one(batch)))
         
-        # Rate limiting
-        if i + batch_size < len(chunks):
-            time.sleep(0.2)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for vectors in await _finished_results(done):
+                yield vectors
+    finally:
+        for task in pending:
+            task.cancel()
+        cache.close()
+        progress.close()
     
-    print(f'✅ Generated {len(embeddings)} embeddings\n')
-    return embeddings
+    tqdm.write(f'✅ Generated {progress.n} embeddings ({cache_hits} from cache, {duplicates} duplicates reused)')
+
+
+async def upload_to_pinecone(queue: asyncio.Queue, index, progress: tqdm):
+    """Upload worker: upsert vector batches from the queue to Pinecone"""
+    while True:
+        vectors = await queue.get()
+        try:
+            # async_req returns a future from the gRPC client; await it without a thread
+            await asyncio.wrap_future(index.upsert(vectors=vectors, async_req=True))
+            progress.update(len(vectors))
+        finally:
+            queue.task_done()
 
 
-def upload_to_pinecone(embeddings: List[Dict], index_name: str):
-    """Upload vectors to Pinecone"""
+async def embed_and_upload(chunks: Iterator[Chunk], index_name: str) -> int:
+    """Pipeline embedding and upload so Pinecone upserts overlap OpenAI requests"""
     print(f'☁️  Uploading to Pinecone index: {index_name}...')
     
     index = pinecone_client.Index(index_name)
+    queue = asyncio.Queue(maxsize=CONFIG['upload_queue_size'])
+    progress = tqdm(desc='upload', unit='vector')
     
-    # Prepare vectors
-    vectors = []
-    for item in embeddings:
-        vectors.append({
-            'id': item['id'],
-            'values': item['embedding'],
-            'metadata': {
-                'text': item['text'],
-                'page': item['page'],
-                'topic': item['topic'],
-                'task': item['task'],
-                'role_min': item['role_min'],
-                'source': 'NextGen-User Manual.pdf',
-                'type': 'documentation'
-            }
-        })
+    workers = [
+        asyncio.create_task(upload_to_pinecone(queue, index, progress))
+        for _ in range(CONFIG['upload_concurrency'])
+    ]
+    
+    async def _produce() -> int:
+        total = 0
+        async for vectors in generate_embeddings(chunks):
+            await queue.put(vectors)
+            total += len(vectors)
+        await queue.join()
+        return total
     
-    # Upload in batches
-    batch_size = 100
-    for i in range(0, len(vectors), batch_size):
-        batch = vectors[i:i + batch_size]
-        index.upsert(vectors=batch)
-        print(f'  Uploaded {min(i + batch_size, len(vectors))}/{len(vectors)} vectors...')
-        time.sleep(0.1)  # Rate limiting
+    pipeline = asyncio.create_task(_produce())
+    try:
+        # Workers only finish early if an upsert fails; surface that instead of hanging
+        done, _ = await asyncio.wait([pipeline, *workers], return_when=asyncio.FIRST_COMPLETED)
+        await _finished_results(done)
+    finally:
+        for task in (pipeline, *workers):
+            task.cancel()
+        await asyncio.gather(pipeline, *workers, return_exceptions=True)
+        progress.close()
     
-    print(f'✅ Uploaded {len(vectors)} vectors\n')
+    print(f'✅ Uploaded {progress.n} vectors\n')
+    return pipeline.result()
+
+
+def init_clients():
+    """Create the OpenAI and Pinecone clients"""
+    global openai_client, pinecone_client
+    openai_client = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'), max_retries=6)
+    pinecone_client = PineconeGRPC(api_key=os.getenv('PINECONE_API_KEY'))
+
+
+def _is_not_found(error: Exception) -> bool:
+    """Whether a Pinecone error means the index/namespace has nothing to delete"""
+    # The gRPC client wraps the grpc.RpcError; its status code is the reliable signal
+    cause = error.__cause__
+    if callable(getattr(cause, 'code', None)) and getattr(cause.code(), 'name', None) == 'NOT_FOUND':
+        return True
+    msg = str(error)
+    return '404' in msg or 'NOT_FOUND' in msg or 'grpc_status:5' in msg
 
 
 def delete_all_vectors(index_name: str):
@@ -257,7 +501,7 @@ def delete_all_vectors(index_name: str):
         print('✅ Index cleared')
         time.sleep(3)  # Wait for propagation
     except Exception as e:
-        if '404' in str(e):
+        if _is_not_found(e):
             print('ℹ️  Index already empty')
         else:
             print(f'⚠️  Could not delete: {e}')
@@ -265,20 +509,28 @@ def delete_all_vectors(index_name: str):
     print()
 
 
-def print_metadata_stats(chunks: List[Dict]):
-    """Print metadata distribution statistics"""
-    topic_counts = {}
-    task_counts = {}
-    role_counts = {}
+def collect_metadata_stats(chunks: Iterable[Chunk], stats: Dict) -> Iterator[Chunk]:
+    """Tally metadata distribution as chunks stream past"""
+    topic_counts = stats.setdefault('topic', Counter())
+    task_counts = stats.setdefault('task', Counter())
+    role_counts = stats.setdefault('role_min', Counter())
     
     for chunk in chunks:
-        topic_counts[chunk['topic']] = topic_counts.get(chunk['topic'], 0) + 1
-        task_counts[chunk['task']] = task_counts.get(chunk['task'], 0) + 1
-        role_counts[chunk['role_min']] = role_counts.get(chunk['role_min'], 0) + 1
+        topic_counts[chunk.topic] += 1
+        task_counts[chunk.task] += 1
+        role_counts[chunk.role_min] += 1
+        yield chunk
+
+
+def print_metadata_stats(stats: Dict):
+    """Print metadata distribution statistics"""
+    topic_counts = stats.get('topic', Counter())
+    task_counts = stats.get('task', Counter())
+    role_counts = stats.get('role_min', Counter())
     
     print('📊 Metadata Distribution:')
-    print(f'  Topics: {dict(sorted(topic_counts.items(), key=lambda x: x[1], reverse=True))}')
-    print(f'  Tasks: {task_counts}')
+    print(f'  Topics: {dict(topic_counts.most_common())}')
+    print(f'  Tasks: {dict(task_counts)}')
     print(f'  Role Minimums: {dict(sorted(role_counts.items()))}')
     print()
 
@@ -287,6 +539,9 @@ def main():
     try:
         print('🚀 NextGen AI RAG - PDF Embedding with Metadata (Python)\n')
         
+        # Load environment variables
+        load_dotenv()
+        
         # Validate environment
         if not os.getenv('OPENAI_API_KEY') or not os.getenv('PINECONE_API_KEY'):
             raise ValueError('Missing API keys in environment variables')
@@ -295,29 +550,27 @@ def main():
         if not index_name:
             raise ValueError('Missing PINECONE_INDEX_NAME in environment variables')
         
+        init_clients()
+        
         # Step 1: Delete existing vectors
         delete_all_vectors(index_name)
         
-        # Step 2: Extract PDF
+        # Step 2 & 3: Stream PDF pages into chunks with metadata
+        print('✂️  Creating intelligent chunks with metadata...')
+        stats = {}
         pages = extract_text_from_pdf(CONFIG['pdf_path'])
+        chunks = collect_metadata_stats(assign_chunk_ids(create_chunks(pages)), stats)
         
-        # Step 3: Create chunks with metadata
-        print('✂️  Creating intelligent chunks with metadata...')
-        chunks = create_chunks(pages)
-        print(f'✅ Created {len(chunks)} chunks\n')
+        # Step 4 & 5: Generate embeddings and upload to Pinecone as chunks stream in
+        total_chunks = asyncio.run(embed_and_upload(chunks, index_name))
+        print(f'✅ Created {total_chunks} chunks\n')
         
         # Show metadata statistics
-        print_metadata_stats(chunks)
-        
-        # Step 4: Generate embeddings
-        embeddings = generate_embeddings(chunks)
-        
-        # Step 5: Upload to Pinecone
-        upload_to_pinecone(embeddings, index_name)
+        print_metadata_stats(stats)
         
         # Success summary
         print('✨ SUCCESS!')
-        print(f'📊 Total chunks: {len(chunks)}')
+        print(f'📊 Total chunks: {total_chunks}')
         print(f'💾 Stored in Pinecone index: {index_name}')
         print('\n🎯 Metadata fields:')
         print('   - topic: (attendance, children, guardians, reports, etc.)')